@@ -1,8 +1,8 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import io
-import re
 
 # ==========================================
 # PAGE CONFIGURATION
@@ -16,113 +16,225 @@ st.markdown("Universal search engine optimized for multiple columns and legions.
 # ==========================================
 # 1. PROCESSING FUNCTION (UNIVERSAL SCANNER)
 # ==========================================
-def process_bod_file(uploaded_file):
-    raw_df = pd.read_excel(uploaded_file, sheet_name="BOD", header=None, dtype=str)
+# Cached on the raw upload bytes so widget interactions don't re-parse the workbook.
+@st.cache_data(show_spinner=False, max_entries=4)
+def process_bod_file(file_bytes: bytes) -> pd.DataFrame:
+    # Arrow-backed strings for the whole-sheet .str passes below
+    raw_df = pd.read_excel(
+        io.BytesIO(file_bytes), sheet_name="BOD", header=None, dtype="string[pyarrow]", engine="calamine"
+    )
+    n_rows, n_cols = raw_df.shape
+    if raw_df.empty:
+        return pd.DataFrame()
     
-    all_data = []
+    blocks = []
     legion_pattern = r"^LEGI[OÓ]N\s*[1-5]$"
     invalid_alliances = {"SCORE", "RANK", "DATE", "TOTAL", "TBD", "UTC", "PLAYER", "NAN"}
     
-    for r in range(raw_df.shape[0]):
-        for c in range(raw_df.shape[1]):
-            cell_val = str(raw_df.iloc[r, c]).strip().upper()
+    # Normalize the whole sheet once; empty cells become "nan"
+    cells = raw_df.fillna("nan").apply(lambda col: col.str.strip())
+    cells_upper = cells.apply(lambda col: col.str.upper())
+    header_mask = cells_upper.apply(lambda col: col.str.match(legion_pattern)).to_numpy(dtype=bool)
+    grid = cells.to_numpy(dtype=object)
+    
+    # Rank cells are split once for the whole sheet; columns are sliced per legion block below
+    rank_grid = cells.apply(lambda col: col.str.split(".").str[0])
+    rank_blank = rank_grid.apply(lambda col: col.str.lower().isin(["nan", ""])).to_numpy(dtype=bool)
+    
+    # First tag cell of each row, forward-filled and shifted so each header sees the nearest tag above it
+    is_tag = cells_upper.apply(
+        lambda col: col.str.len().between(2, 5) & col.str.isalpha() & ~col.isin(invalid_alliances)
+    ).to_numpy(dtype=bool)
+    grid_upper = cells_upper.to_numpy(dtype=object)
+    row_tag = np.where(is_tag.any(axis=1), grid_upper[np.arange(n_rows), is_tag.argmax(axis=1)], None)
+    alliance_above = pd.Series(row_tag, dtype=object).ffill().shift(1).fillna("Default").to_numpy()
+    
+    # np.nonzero walks the mask row by row, matching the original scan order
+    header_rows, header_cols = np.nonzero(header_mask)
+    
+    def header_cells(offset):
+        # Cell `offset` columns right of every header, "TBD" past the sheet edge
+        cols = header_cols + offset
+        inside = cols < n_cols
+        values = np.full(len(cols), "TBD", dtype=object)
+        values[inside] = grid[header_rows[inside], cols[inside]]
+        return pd.Series(values, dtype="string[pyarrow]")
+    
+    # Date and schedule labels for all headers in a few vectorized passes
+    date_vals = header_cells(1)
+    hour_vals = header_cells(2)
+    date_labels = date_vals.str.split(" ").str[0].str.replace("-", "/", regex=False)
+    date_labels = date_labels.mask(date_vals.str.lower() == "nan", "TBD")
+    h_num = hour_vals.str.split(".").str[0]
+    hour_labels = h_num.where(h_num.str.upper().str.contains("UTC", regex=False), h_num + " UTC")
+    hour_labels = hour_labels.mask(hour_vals.str.lower() == "nan", "TBD")
+    
+    for r, c, date_clean, hour_clean in zip(header_rows, header_cols, date_labels, hour_labels):
+        legion_name = grid[r, c]
+        alliance_name = alliance_above[r]
+        
+        # The player block runs from r + 2 down to the first blank rank cell
+        stop = rank_blank[r + 2:, c]
+        end = r + 2 + (stop.argmax() if stop.any() else len(stop))
+        ranks = rank_grid.iloc[r + 2:end, c]
+        players = cells.iloc[r + 2:end, c+1] if c+1 < n_cols else pd.Series("nan", index=ranks.index)
+        scores = cells.iloc[r + 2:end, c+2] if c+2 < n_cols else pd.Series("0", index=ranks.index)
+        
+        keep = ranks.str.isdigit() & ~players.str.lower().isin(["nan", "", "player", "joueur", "jugador"])
+        score = pd.to_numeric(
+            scores[keep].str.replace(" ", "", regex=False).str.replace(",", "", regex=False).str.replace("_", "", regex=False),
+            errors='coerce'
+        ).fillna(0.0).astype(float).to_numpy()
+        
+        blocks.append(pd.DataFrame({
+            'Alliance': alliance_name,
+            'Date': date_clean,
+            'Schedule': hour_clean,
+            'Legion': legion_name,
+            'Player': players[keep].to_numpy(),
+            'Score': score,
+            '_active': score > 0
+        }))
             
-            if re.match(legion_pattern, cell_val):
-                legion_name = str(raw_df.iloc[r, c]).strip()
-                
-                date_val = str(raw_df.iloc[r, c+1]).strip() if c+1 < raw_df.shape[1] else "TBD"
-                hour_val = str(raw_df.iloc[r, c+2]).strip() if c+2 < raw_df.shape[1] else "TBD"
-                
-                date_clean = date_val.split(" ")[0].replace("-", "/") if date_val.lower() != "nan" else "TBD"
-                if hour_val.lower() == "nan": 
-                    hour_clean = "TBD"
-                else:
-                    h_num = hour_val.split(".")[0]
-                    hour_clean = f"{h_num} UTC" if "UTC" not in h_num.upper() else h_num
-
-                alliance_name = "Default"
-                for search_r in range(r - 1, -1, -1):
-                    found = False
-                    for search_c in range(raw_df.shape[1]):
-                        potential = str(raw_df.iloc[search_r, search_c]).strip().upper()
-                        if 2 <= len(potential) <= 5 and potential.isalpha() and potential not in invalid_alliances:
-                            alliance_name = str(raw_df.iloc[search_r, search_c]).strip().upper()
-                            found = True
-                            break
-                    if found:
-                        break
-                
-                for k in range(r + 2, raw_df.shape[0]):
-                    rank_cell = str(raw_df.iloc[k, c]).strip().split('.')[0]
-                    player_cell = str(raw_df.iloc[k, c+1]).strip() if c+1 < raw_df.shape[1] else "nan"
-                    score_cell = str(raw_df.iloc[k, c+2]).strip() if c+2 < raw_df.shape[1] else "0"
-                    
-                    if rank_cell.lower() == "nan" or rank_cell == "": break
-                    if not rank_cell.isdigit(): continue
-                    if player_cell.lower() in ["nan", "", "player", "joueur", "jugador"]: continue
-                    
-                    try:
-                        score = float(score_cell.replace(" ", "").replace(",", ""))
-                    except:
-                        score = 0.0
-                        
-                    all_data.append({
-                        'Alliance': alliance_name,
-                        'Date': date_clean,
-                        'Schedule': hour_clean,
-                        'Legion': legion_name,
-                        'Player': player_cell,
-                        'Score': score,
-                        'Status': 'Active' if score > 0 else 'Inactive'
-                    })
-                    
-    return pd.DataFrame(all_data)
+    if not blocks:
+        return pd.DataFrame()
+    
+    df = pd.concat(blocks, ignore_index=True)
+    # Narrowest integer dtype for whole-number scores; stays float64 if any are fractional
+    df['Score'] = pd.to_numeric(df['Score'], downcast='integer')
+    # Label columns repeat heavily; store them as categoricals
+    for col in ['Alliance', 'Date', 'Schedule', 'Legion', 'Player']:
+        df[col] = df[col].astype('category')
+    # Status codes follow the active flag: 0 = Active, 1 = Inactive
+    df['Status'] = pd.Categorical.from_codes((~df['_active'].to_numpy()).view('i1'), categories=['Active', 'Inactive'])
+    return df
 
 # ==========================================
-# 2. DATA LOADING & FILTERS
+# 2. AGGREGATIONS (CACHED PER SELECTION)
+# ==========================================
+def fast_mode(df, keys, value):
+    # Most frequent value per group; values are factorized sorted, so ties
+    # resolve to the smallest one like Series.mode().iloc[0]
+    grouped = df.groupby(keys, observed=True)
+    group_codes = grouped.ngroup().to_numpy()
+    value_codes, values = pd.factorize(df[value], sort=True)
+    n_groups, n_values = grouped.ngroups, len(values)
+    counts = np.bincount(group_codes * n_values + value_codes, minlength=n_groups * n_values)
+    winners = counts.reshape(n_groups, n_values).argmax(axis=1)
+    return pd.Series(values[winners], index=grouped.size().index)
+
+# Builders are memoized on the scan plus the sidebar selection
+@st.cache_data(show_spinner=False)
+def build_weekly_summary(df, sel_alliances, sel_dates):
+    df_filtered = df[(df['Alliance'].isin(sel_alliances)) & (df['Date'].isin(sel_dates))]
+    if df_filtered.empty:
+        return df_filtered, None
+
+    # Active is the sum of the _active flag; Inactive is the remainder
+    summary = df_filtered.groupby(['Alliance', 'Legion', 'Schedule'], observed=True).agg(
+        Total_Players=('Player', 'count'),
+        Active=('_active', 'sum'),
+        Total_Score=('Score', 'sum')
+    ).reset_index()
+    summary['Inactive'] = summary['Total_Players'] - summary['Active']
+
+    summary['% Participation'] = (summary['Active'] / summary['Total_Players']) * 100
+    summary = summary[['Alliance', 'Legion', 'Schedule', 'Total_Players', 'Active', 'Inactive', 'Total_Score', '% Participation']]
+    return df_filtered, summary
+
+@st.cache_data(show_spinner=False)
+def build_legion_tables(df_filtered):
+    # Number players within each (alliance, legion, status) list and pivot once;
+    # shorter columns come back as NaN and are blanked
+    ranked = df_filtered.assign(
+        Player=df_filtered['Player'].astype(str),
+        Rank=df_filtered.groupby(['Alliance', 'Legion', '_active'], observed=True).cumcount()
+    )
+    wide = ranked.pivot(index=['Alliance', '_active', 'Rank'], columns='Legion', values='Player')
+    parts = dict(iter(wide.groupby(level=['Alliance', '_active'], observed=True)))
+
+    # One column per legion, labelled with the schedule of its first row
+    schedules = df_filtered.groupby(['Alliance', 'Legion'], observed=True)['Schedule'].first()
+    schedule_short = schedules.astype(str).str.replace(" UTC", "", regex=False).str.replace(":00:00", ":00", regex=False)
+    labels = pd.Series(
+        schedules.index.get_level_values('Legion').astype(str) + " (" + schedule_short.to_numpy() + ")",
+        index=schedules.index
+    )
+
+    def create_legion_table(alliance, active, legion_labels):
+        part = parts.get((alliance, active))
+        table = part.reindex(columns=legion_labels.index) if part is not None else pd.DataFrame(columns=legion_labels.index)
+        table.columns = legion_labels.to_list()
+        return table.fillna("").reset_index(drop=True)
+
+    tables = {}
+    for alliance, legion_labels in labels.groupby(level='Alliance', observed=True):
+        legion_labels = legion_labels.droplevel('Alliance')
+        tables[alliance] = (
+            create_legion_table(alliance, True, legion_labels),
+            create_legion_table(alliance, False, legion_labels)
+        )
+    return tables
+
+@st.cache_data(show_spinner=False)
+def build_season_ranking(df, sel_alliances, total_events):
+    player_base = df[df['Alliance'].isin(sel_alliances)]
+    if player_base.empty:
+        return None
+
+    # Total_Score and Attendances (_active) reduce in one groupby sum
+    p_ranking = player_base.groupby(['Player', 'Alliance'], observed=True)[['Score', '_active']].sum().rename(
+        columns={'Score': 'Total_Score', '_active': 'Attendances'}
+    )
+    p_ranking['Favorite_Hour'] = fast_mode(player_base, ['Player', 'Alliance'], 'Schedule')
+    p_ranking = p_ranking.reset_index()
+
+    p_ranking['Participation %'] = (p_ranking['Attendances'] / total_events) * 100
+    return p_ranking.sort_values('Total_Score', ascending=False)
+
+@st.cache_data(show_spinner=False)
+def build_report_xlsx(summary, p_ranking) -> bytes:
+    buffer = io.BytesIO()
+    # Names are never links. Don't enable constant_memory: to_excel writes column by column
+    with pd.ExcelWriter(buffer, engine='xlsxwriter', engine_kwargs={'options': {'strings_to_urls': False}}) as writer:
+        if summary is not None: summary.to_excel(writer, sheet_name='Summary', index=False)
+        if p_ranking is not None: p_ranking.to_excel(writer, sheet_name='Ranking', index=False)
+    return buffer.getvalue()
+
+# ==========================================
+# 3. DATA LOADING & FILTERS
 # ==========================================
 uploaded_file = st.sidebar.file_uploader("📂 Upload Excel (BOD Sheet)", type=['xlsx', 'xlsm'])
 
 if uploaded_file is not None:
     try:
-        df = process_bod_file(uploaded_file)
+        df = process_bod_file(uploaded_file.getvalue())
         
         if df.empty:
             st.error("⚠️ No data detected. Please check the format.")
             st.stop()
 
-        total_events = df['Date'].nunique()
-        alliances = sorted(df['Alliance'].unique())
+        # process_bod_file casts the full scan, so the categories are exactly the observed
+        # values in sorted order; a filtered frame would carry unused categories here
+        alliances = df['Alliance'].cat.categories.to_list()
         sel_alliances = st.sidebar.multiselect("🛡️ Alliances:", alliances, default=alliances)
         
-        dates = sorted(df['Date'].unique(), reverse=True)
+        dates = df['Date'].cat.categories[::-1].to_list()
+        total_events = len(dates)
         sel_dates = st.sidebar.multiselect("📅 Select Dates:", dates, default=dates[:1])
 
         if not sel_dates:
             st.warning("Select at least one date to view the summary.")
             st.stop()
 
-        df_filtered = df[(df['Alliance'].isin(sel_alliances)) & (df['Date'].isin(sel_dates))]
+        df_filtered, summary = build_weekly_summary(df, sel_alliances, sel_dates)
 
         # ==========================================
         # SECTION 1: ACTIVITY SUMMARY & CHART
         # ==========================================
         st.header("1. Weekly Summary")
         
-        if not df_filtered.empty:
-            summary = df_filtered.groupby(['Alliance', 'Legion', 'Schedule']).agg(
-                Total_Players=('Player', 'count'),
-                Total_Score=('Score', 'sum')
-            ).reset_index()
-
-            status_counts = df_filtered.groupby(['Alliance', 'Legion', 'Schedule', 'Status']).size().unstack(fill_value=0).reset_index()
-            if 'Active' not in status_counts.columns: status_counts['Active'] = 0
-            if 'Inactive' not in status_counts.columns: status_counts['Inactive'] = 0
-
-            summary = summary.merge(status_counts[['Alliance', 'Legion', 'Schedule', 'Active', 'Inactive']], on=['Alliance', 'Legion', 'Schedule'])
-            summary['% Participation'] = (summary['Active'] / summary['Total_Players']) * 100
-            summary = summary[['Alliance', 'Legion', 'Schedule', 'Total_Players', 'Active', 'Inactive', 'Total_Score', '% Participation']]
-
+        if summary is not None:
             st.dataframe(
                 summary.style.format({'Total_Score': '{:,.0f}', '% Participation': '{:.1f}%'}),
                 use_container_width=True, hide_index=True
@@ -132,7 +244,10 @@ if uploaded_file is not None:
             if len(sel_alliances) > 0:
                 chart_alliance = st.selectbox("Select Alliance for the chart:", sel_alliances)
                 
-                chart_data = df_filtered[df_filtered['Alliance'] == chart_alliance].groupby(['Legion', 'Status']).size().reset_index(name='Count')
+                # Chart counts come from the summary's Active/Inactive columns
+                chart_data = summary[summary['Alliance'] == chart_alliance].groupby('Legion', observed=True)[['Active', 'Inactive']].sum()
+                chart_data = chart_data.reset_index().melt(id_vars='Legion', var_name='Status', value_name='Count')
+                chart_data = chart_data[chart_data['Count'] > 0].sort_values(['Legion', 'Status'])
                 
                 if not chart_data.empty:
                     fig = px.bar(
@@ -154,40 +269,13 @@ if uploaded_file is not None:
                 # Create a tab for each selected alliance
                 tabs = st.tabs(sel_alliances)
                 
+                legion_tables = build_legion_tables(df_filtered)
+                
                 for idx, alliance in enumerate(sel_alliances):
                     with tabs[idx]:
-                        df_detailed = df_filtered[df_filtered['Alliance'] == alliance]
-                        legions_list = sorted(df_detailed['Legion'].unique())
+                        df_active, df_inactive = legion_tables.get(alliance, (None, None))
                         
-                        if legions_list:
-                            active_dict = {}
-                            inactive_dict = {}
-                            
-                            for legion in legions_list:
-                                legion_subset = df_detailed[df_detailed['Legion'] == legion]
-                                schedule = legion_subset['Schedule'].iloc[0] if not legion_subset.empty else ""
-                                
-                                schedule_short = schedule.replace(" UTC", "").replace(":00:00", ":00")
-                                col_name = f"{legion} ({schedule_short})"
-                                
-                                active_players = legion_subset[legion_subset['Status'] == 'Active']['Player'].tolist()
-                                inactive_players = legion_subset[legion_subset['Status'] == 'Inactive']['Player'].tolist()
-                                
-                                active_dict[col_name] = active_players
-                                inactive_dict[col_name] = inactive_players
-                            
-                            # Pad the lists so they are all the same length
-                            max_active = max([len(v) for v in active_dict.values()]) if active_dict else 0
-                            for k in active_dict:
-                                active_dict[k].extend([""] * (max_active - len(active_dict[k])))
-                                
-                            max_inactive = max([len(v) for v in inactive_dict.values()]) if inactive_dict else 0
-                            for k in inactive_dict:
-                                inactive_dict[k].extend([""] * (max_inactive - len(inactive_dict[k])))
-                            
-                            df_active = pd.DataFrame(active_dict)
-                            df_inactive = pd.DataFrame(inactive_dict)
-                            
+                        if df_active is not None:
                             col1, col2 = st.columns(2)
                             with col1:
                                 st.markdown("✅ **Active Players**")
@@ -206,17 +294,8 @@ if uploaded_file is not None:
         st.divider()
         st.header("2. Season Player Ranking")
         
-        player_base = df[df['Alliance'].isin(sel_alliances)]
-        if not player_base.empty:
-            p_ranking = player_base.groupby(['Player', 'Alliance']).agg(
-                Total_Score=('Score', 'sum'),
-                Attendances=('Status', lambda x: (x == 'Active').sum()),
-                Favorite_Hour=('Schedule', lambda x: x.mode().iloc[0] if not x.mode().empty else "N/A")
-            ).reset_index()
-
-            p_ranking['Participation %'] = (p_ranking['Attendances'] / total_events) * 100
-            p_ranking = p_ranking.sort_values('Total_Score', ascending=False)
-
+        p_ranking = build_season_ranking(df, sel_alliances, total_events)
+        if p_ranking is not None:
             st.dataframe(
                 p_ranking.style.format({'Total_Score': '{:,.0f}', 'Participation %': '{:.1f}%'}),
                 use_container_width=True, hide_index=True
@@ -226,12 +305,8 @@ if uploaded_file is not None:
         # EXPORTS
         # ==========================================
         st.sidebar.divider()
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            if not df_filtered.empty: summary.to_excel(writer, sheet_name='Summary', index=False)
-            if not player_base.empty: p_ranking.to_excel(writer, sheet_name='Ranking', index=False)
-            
-        st.sidebar.download_button("📥 Download Excel", buffer, "BOD_Report.xlsx")
+        # The workbook is only written when the button is clicked
+        st.sidebar.download_button("📥 Download Excel", lambda: build_report_xlsx(summary, p_ranking), "BOD_Report.xlsx")
 
     except Exception as e:
         st.error(f"Error: {e}")